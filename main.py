@@ -1,29 +1,52 @@
 import os
+import re
+import asyncio
 import logging
 import uuid
-import json
+import threading
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta, timezone
 
-from fastapi import FastAPI, HTTPException
+import anyio
+import httpx
+import orjson
+from cachetools import TTLCache
+from fastapi import BackgroundTasks, FastAPI, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from datetime import datetime, timedelta, timezone
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field
 
 import google.auth
 from google import genai
 from google.genai import types
-from google.cloud import storage
-from google.auth.transport.requests import Request
 
 
 logger = logging.getLogger("talky.api")
-if not logger.handlers:
+if not logging.getLogger().handlers:
+    # --log-config 등으로 이미 구성된 루트 핸들러는 유지
     logging.basicConfig(
         level=logging.INFO,
         format="%(asctime)s %(levelname)s [%(name)s] %(message)s",
     )
 
-app = FastAPI()
+# Gemini 호출 공통 커넥션 풀 설정 (버스트 대비 상향, HTTP/2 keep-alive)
+_HTTP_LIMITS = httpx.Limits(max_connections=500, max_keepalive_connections=200, keepalive_expiry=60)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 블로킹 서명 작업용 스레드풀 기본값(40) 상향
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 200
+    # Gemini REST 호출용 공유 클라이언트 (요청마다 TCP/TLS 핸드셰이크 방지)
+    app.state.http = httpx.AsyncClient(http2=True, timeout=10, limits=_HTTP_LIMITS)
+    try:
+        yield
+    finally:
+        await app.state.http.aclose()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -47,11 +70,45 @@ if not GCS_BUCKET:
 
 SIGNED_URL_TTL_SECONDS = int(os.environ.get("SIGNED_URL_TTL_SECONDS", "600"))
 
+# 같은 경로에 대한 반복 서명 방지: URL 유효기간의 절반 동안만 재사용
+_url_cache = TTLCache(maxsize=10000, ttl=SIGNED_URL_TTL_SECONDS // 2)
+_url_cache_lock = threading.Lock()
+
+# 서명 시 라이브러리가 메타데이터 서버로 SA 이메일을 조회하지 않도록 반드시 지정
 SERVICE_ACCOUNT_EMAIL = os.environ.get("SERVICE_ACCOUNT_EMAIL")
+if not SERVICE_ACCOUNT_EMAIL:
+    raise RuntimeError("SERVICE_ACCOUNT_EMAIL is not set")
+
+AUTH_TOKENS_URL = "https://generativelanguage.googleapis.com/v1alpha/auth_tokens"
+_TOKEN_EXPIRE = timedelta(minutes=30)
+_NEW_SESSION_EXPIRE = timedelta(minutes=1)
+
+# SDK 내부에서 요청마다 httpx 클라이언트를 만들지 않도록 풀링된 클라이언트 설정을 전달.
+# http2/limits는 httpx 전용 설정이므로 transport를 명시해 aiohttp가 설치돼 있어도 httpx 경로를 강제함
+client = genai.Client(
+    api_key=GEMINI_API_KEY,
+    http_options=types.HttpOptions(
+        async_client_args={"transport": httpx.AsyncHTTPTransport(http2=True, limits=_HTTP_LIMITS)},
+    ),
+)
 
-client = genai.Client(api_key=GEMINI_API_KEY)
-storage_client = storage.Client()
-bucket = storage_client.bucket(GCS_BUCKET)
+
+_bucket_obj = None
+_bucket_lock = threading.Lock()
+
+
+def _bucket():
+    # google.cloud.storage는 임포트만으로 수백 ms가 걸리므로 첫 GCS 사용 시점까지 지연.
+    # 동시 첫 호출에서 Client가 중복 생성되지 않도록 락 + 이중 확인
+    global _bucket_obj
+    if _bucket_obj is None:
+        with _bucket_lock:
+            if _bucket_obj is None:
+                from google.cloud import storage
+
+                creds, project = _get_default_auth()
+                _bucket_obj = storage.Client(project=project, credentials=creds).bucket(GCS_BUCKET)
+    return _bucket_obj
 
 
 class SessionCreateRequest(BaseModel):
@@ -71,26 +128,69 @@ def session_prefix(session_id: str):
     return f"sessions/{session_id}"
 
 
+# sessions/<uuid>/<상대경로>, ".." 세그먼트 불허
+_SESSION_PATH_RE = re.compile(r"sessions/([0-9a-f-]{36})/(?!(?:.*/)?\.\.(?:/|$))(.+)")
+
+
 def assert_session_path(session_id: str, path: str):
     normalized = path.lstrip("/")
-    expected_prefix = f"{session_prefix(session_id)}/"
-    if not normalized.startswith(expected_prefix):
+    m = _SESSION_PATH_RE.fullmatch(normalized)
+    if m is None or m.group(1) != session_id:
+        if normalized.startswith(f"{session_prefix(session_id)}/"):
+            raise HTTPException(status_code=400, detail="invalid path")
         raise HTTPException(status_code=400, detail="path must be inside session prefix")
-    if ".." in normalized.split("/"):
-        raise HTTPException(status_code=400, detail="invalid path")
     return normalized
 
 
+_default_auth = None
+_default_auth_lock = threading.Lock()
+
+
+def _get_default_auth():
+    # ADC 탐색은 한 번만: 서명 토큰과 storage.Client가 같은 자격증명/프로젝트 공유
+    global _default_auth
+    if _default_auth is None:
+        with _default_auth_lock:
+            if _default_auth is None:
+                _default_auth = google.auth.default(
+                    scopes=["https://www.googleapis.com/auth/cloud-platform"]
+                )
+    return _default_auth
+
+
+def _get_credentials():
+    return _get_default_auth()[0]
+
+
+# 서명용 토큰 갱신만 직렬화함. 같은 자격증명을 쓰는 storage.Client의 transport는
+# 이 락 없이 자체적으로 refresh하므로 모든 갱신을 보호하지는 않음 (토큰/만료 덮어쓰기뿐이라 무해)
+_creds_lock = threading.Lock()
+_TOKEN_REFRESH_MARGIN = timedelta(seconds=300)
+
+
 def _get_access_token():
-    creds, _ = google.auth.default(scopes=["https://www.googleapis.com/auth/cloud-platform"])
-    creds.refresh(Request())
-    return creds.token
+    # 만료 5분 전까지는 캐시된 토큰 재사용 (메타데이터 서버 왕복 방지)
+    creds = _get_credentials()
+    with _creds_lock:
+        expiry = creds.expiry  # google-auth는 naive UTC datetime 사용
+        now = datetime.now(tz=timezone.utc).replace(tzinfo=None)
+        if not creds.valid or (expiry is not None and expiry - now < _TOKEN_REFRESH_MARGIN):
+            from google.auth.transport.requests import Request
+
+            creds.refresh(Request())
+        return creds.token
 
 def put_signed_url(path: str, content_type: str):
-    blob = bucket.blob(path)
+    key = ("PUT", path, content_type)
+    with _url_cache_lock:
+        url = _url_cache.get(key)
+    if url is not None:
+        return url
+
+    blob = _bucket().blob(path)
     access_token = _get_access_token()
 
-    return blob.generate_signed_url(
+    url = blob.generate_signed_url(
         version="v4",
         expiration=timedelta(seconds=SIGNED_URL_TTL_SECONDS),
         method="PUT",
@@ -98,48 +198,87 @@ def put_signed_url(path: str, content_type: str):
         service_account_email=SERVICE_ACCOUNT_EMAIL,  # 서명에 사용할 SA 이메일
         access_token=access_token,                   # 방금 갱신한 토큰
     )
+    with _url_cache_lock:
+        _url_cache[key] = url
+    return url
 
 def get_signed_url(path: str):
-    blob = bucket.blob(path)
+    key = ("GET", path, None)
+    with _url_cache_lock:
+        url = _url_cache.get(key)
+    if url is not None:
+        return url
+
+    blob = _bucket().blob(path)
     access_token = _get_access_token()
 
-    return blob.generate_signed_url(
+    url = blob.generate_signed_url(
         version="v4",
         expiration=timedelta(seconds=SIGNED_URL_TTL_SECONDS),
         method="GET",
         service_account_email=SERVICE_ACCOUNT_EMAIL,
         access_token=access_token,
     )
+    with _url_cache_lock:
+        _url_cache[key] = url
+    return url
 
 
 @app.get("/healthz")
-def healthz():
+async def healthz():
     return {"ok": True}
 
 
 @app.post("/api/ephemeral-token")
-def create_ephemeral_token():
+async def create_ephemeral_token():
     try:
-        expire_time = datetime.now(tz=timezone.utc) + timedelta(minutes=30)
-        new_session_expire_time = datetime.now(tz=timezone.utc) + timedelta(minutes=1)
-
-        token = client.auth_tokens.create(
-            config={
+        now = datetime.now(tz=timezone.utc)
+        expire_time = now + _TOKEN_EXPIRE
+        new_session_expire_time = now + _NEW_SESSION_EXPIRE
+
+        r = await app.state.http.post(
+            AUTH_TOKENS_URL,
+            headers={"x-goog-api-key": GEMINI_API_KEY},
+            json={
                 "uses": 1,
                 "expireTime": expire_time.isoformat(),
                 "newSessionExpireTime": new_session_expire_time.isoformat(),
-                "httpOptions": {"apiVersion": "v1alpha"},
-            }
+            },
         )
-        return {"token": token.name, "expiresInSeconds": 60}
+        if r.is_error:
+            # API 오류 메시지(키 오류, 쿼터 초과 등)를 로그에 남기기 위해 응답 본문 포함
+            raise RuntimeError(f"auth_tokens.create failed status={r.status_code} body={r.text}")
+        return {"token": r.json()["name"], "expiresInSeconds": 60}
 
-    except Exception as e:
-        print("Ephemeral token error:", repr(e))
+    except Exception:
+        logger.exception("Ephemeral token error")
         raise HTTPException(status_code=500, detail="Failed to create ephemeral token")
 
 
+def _seed_json(path: str, data: bytes):
+    # 응답 이후 실행되므로 클라이언트가 먼저 올린 객체를 덮어쓰지 않도록 없을 때만 생성
+    from google.api_core.exceptions import PreconditionFailed
+
+    try:
+        _bucket().blob(path).upload_from_string(
+            data=data,
+            content_type="application/json",
+            if_generation_match=0,
+        )
+    except PreconditionFailed:
+        pass
+    except Exception:
+        logger.exception("Session bootstrap write error path=%s", path)
+
+
+def _write_session_bootstrap(prefix: str, transcript_index_path: str, metadata: dict):
+    # Optional bootstrap files for easier troubleshooting.
+    _seed_json(f"{prefix}/session.json", orjson.dumps(metadata))
+    _seed_json(transcript_index_path, orjson.dumps({"items": []}))
+
+
 @app.post("/api/session/create")
-def create_session(req: SessionCreateRequest):
+async def create_session(req: SessionCreateRequest, background_tasks: BackgroundTasks):
     try:
         session_id = str(uuid.uuid4())
         prefix = session_prefix(session_id)
@@ -153,14 +292,12 @@ def create_session(req: SessionCreateRequest):
             "prefix": prefix,
         }
 
-        # Optional bootstrap files for easier troubleshooting.
-        bucket.blob(f"{prefix}/session.json").upload_from_string(
-            data=json.dumps(metadata),
-            content_type="application/json",
-        )
-        bucket.blob(transcript_index_path).upload_from_string(
-            data='{"items":[]}',
-            content_type="application/json",
+        # 부트스트랩 파일은 응답 이후 백그라운드에서 기록 (요청 경로에서 GCS 왕복 제거)
+        background_tasks.add_task(_write_session_bootstrap, prefix, transcript_index_path, metadata)
+
+        manifest_upload_url, manifest_read_url = await asyncio.gather(
+            run_in_threadpool(put_signed_url, manifest_path, "application/json"),
+            run_in_threadpool(get_signed_url, manifest_path),
         )
 
         return {
@@ -168,49 +305,52 @@ def create_session(req: SessionCreateRequest):
             "bucket": GCS_BUCKET,
             "prefix": prefix,
             "manifestPath": manifest_path,
-            "manifestUploadUrl": put_signed_url(manifest_path, "application/json"),
-            "manifestReadUrl": get_signed_url(manifest_path),
+            "manifestUploadUrl": manifest_upload_url,
+            "manifestReadUrl": manifest_read_url,
             "uploadUrlEndpoint": f"/api/session/{session_id}/upload-url",
             "readUrlEndpoint": f"/api/session/{session_id}/read-url",
             "createdAt": metadata["createdAt"],
         }
     except HTTPException:
         raise
-    except Exception as e:
-        print("session/create error:", repr(e))
+    except Exception:
+        logger.exception("Session create error")
         raise HTTPException(status_code=500, detail="Failed to create session")
 
 
 @app.post("/api/session/{session_id}/upload-url")
-def sign_upload_url(session_id: str, req: SignUrlRequest):
+async def sign_upload_url(session_id: uuid.UUID, req: SignUrlRequest):
     try:
         content_type = req.contentType or "application/octet-stream"
-        path = assert_session_path(session_id, req.path)
-        return {"url": put_signed_url(path, content_type), "path": path}
+        path = assert_session_path(str(session_id), req.path)
+        url = await run_in_threadpool(put_signed_url, path, content_type)
+        return {"url": url, "path": path}
     except HTTPException:
         raise
-    except Exception as e:
-        print("upload-url error:", repr(e))
+    except Exception:
+        logger.exception("Upload URL error")
         raise HTTPException(status_code=500, detail="Failed to sign upload URL")
 
 
 @app.post("/api/session/{session_id}/read-url")
-def sign_read_url(session_id: str, req: SignUrlRequest):
+async def sign_read_url(session_id: uuid.UUID, req: SignUrlRequest):
     try:
-        path = assert_session_path(session_id, req.path)
-        return {"url": get_signed_url(path), "path": path}
+        path = assert_session_path(str(session_id), req.path)
+        url = await run_in_threadpool(get_signed_url, path)
+        return {"url": url, "path": path}
     except HTTPException:
         raise
-    except Exception as e:
-        print("read-url error:", repr(e))
+    except Exception:
+        logger.exception("Read URL error")
         raise HTTPException(status_code=500, detail="Failed to sign read URL")
 
 
 class GenerateLessonRequest(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True)
+
     interest: str = Field(..., min_length=2, max_length=120)
 
-def _build_lesson_prompt(interest: str) -> str:
-    return f"""
+_LESSON_PROMPT_TMPL = """
 You are a news researcher. Find the most recent and trending news or issue
 about "{interest}" and write a lesson material in English, approximately
 300 characters.
@@ -222,29 +362,30 @@ Format:
 - Plain text only (no markdown)
 """.strip()
 
-def _extract_text_from_response(resp) -> str:
-    chunks: list[str] = []
-    candidate_count = 0
-    part_count = 0
-
-    for cand in (getattr(resp, "candidates", None) or []):
-        candidate_count += 1
-        content = getattr(cand, "content", None)
-        parts = getattr(content, "parts", None) or []
-        part_count += len(parts)
+def _build_lesson_prompt(interest: str) -> str:
+    return _LESSON_PROMPT_TMPL.format(interest=interest)
 
-        for part in parts:
-            t = getattr(part, "text", None)
-            if isinstance(t, str) and t.strip():
-                chunks.append(t.strip())
+def _extract_text_from_response(resp) -> str:
+    candidates = getattr(resp, "candidates", None) or []
+    chunks = [
+        stripped
+        for cand in candidates
+        for part in (getattr(getattr(cand, "content", None), "parts", None) or [])
+        if isinstance(t := getattr(part, "text", None), str) and (stripped := t.strip())
+    ]
 
     if chunks:
         merged = "\n".join(chunks).strip()
-        line_count = len([ln for ln in merged.splitlines() if ln.strip()])
-        logger.info(
-            "[generate-lesson] extracted from parts candidates=%d parts=%d chars=%d lines=%d",
-            candidate_count, part_count, len(merged), line_count
-        )
+        if logger.isEnabledFor(logging.INFO):
+            part_count = sum(
+                len(getattr(getattr(cand, "content", None), "parts", None) or [])
+                for cand in candidates
+            )
+            line_count = len([ln for ln in merged.splitlines() if ln.strip()])
+            logger.info(
+                "[generate-lesson] extracted from parts candidates=%d parts=%d chars=%d lines=%d",
+                len(candidates), part_count, len(merged), line_count
+            )
         return merged
 
     # parts가 없을 때만 fallback
@@ -260,7 +401,7 @@ def _extract_text_from_response(resp) -> str:
 
     logger.warning(
         "[generate-lesson] empty Gemini response candidates=%d",
-        candidate_count
+        len(candidates)
     )
     return ""
 
@@ -268,21 +409,17 @@ def _extract_text_from_response(resp) -> str:
 # 필요하면 상수로 분리
 LESSON_GEN_CONFIG = types.GenerateContentConfig(
     temperature=0.6,
-    max_output_tokens=22000,  # curl과 동일. (운영에선 1024~4096로 낮추는 것 권장)
+    max_output_tokens=2048,  # 약 300자 교재 기준 충분. 상한이 클수록 생성 지연 증가
     response_mime_type="text/plain",
     thinking_config=types.ThinkingConfig(thinking_budget=10),
 )
 
 @app.post("/api/generate-lesson")
-def generate_lesson(req: GenerateLessonRequest):
+async def generate_lesson(req: GenerateLessonRequest):
     try:
-        interest = req.interest.strip()
-        if not interest:
-            raise HTTPException(status_code=400, detail="interest is required")
-
-        prompt = _build_lesson_prompt(interest)
+        prompt = _build_lesson_prompt(req.interest)
 
-        resp = client.models.generate_content(
+        resp = await client.aio.models.generate_content(
             model="gemini-2.5-flash",
             contents=prompt,
             config=LESSON_GEN_CONFIG,
@@ -317,3 +454,26 @@ def generate_lesson(req: GenerateLessonRequest):
         logger.exception("Generate lesson error")
         raise HTTPException(status_code=500, detail="Failed to generate lesson")
 
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    def _available_cpus():
+        # nproc과 동일하게 컨테이너의 CPU affinity 기준 (os.cpu_count()는 호스트 전체 CPU 수)
+        if hasattr(os, "process_cpu_count"):
+            return os.process_cpu_count() or 1
+        if hasattr(os, "sched_getaffinity"):
+            return len(os.sched_getaffinity(0))
+        return os.cpu_count() or 1
+
+    # uvicorn main:app --host 0.0.0.0 --port $PORT --loop uvloop --http httptools --workers $(nproc) --backlog 2048
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.environ.get("PORT", "8080")),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.environ.get("WEB_CONCURRENCY", _available_cpus())),
+        backlog=2048,
+    )
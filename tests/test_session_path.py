@@ -0,0 +1,46 @@
+import os
+
+import pytest
+from fastapi import HTTPException
+
+os.environ.setdefault("GEMINI_API_KEY", "test-key")
+os.environ.setdefault("GCS_BUCKET", "test-bucket")
+os.environ.setdefault("SERVICE_ACCOUNT_EMAIL", "signer@test.iam.gserviceaccount.com")
+
+from main import assert_session_path  # noqa: E402
+
+SESSION_ID = "12345678-1234-4234-8234-123456789abc"
+OTHER_SESSION_ID = "87654321-4321-4321-8321-cba987654321"
+
+
+@pytest.mark.parametrize(
+    "tail",
+    ["manifest.json", "transcript/index.json", "...", "..a", "a..", "a//b"],
+)
+def test_accepts_paths_inside_session(tail):
+    path = f"sessions/{SESSION_ID}/{tail}"
+    assert assert_session_path(SESSION_ID, path) == path
+    assert assert_session_path(SESSION_ID, f"/{path}") == path
+
+
+@pytest.mark.parametrize("tail", ["..", "../x", "a/..", "a/../b", ""])
+def test_rejects_invalid_paths(tail):
+    with pytest.raises(HTTPException) as exc:
+        assert_session_path(SESSION_ID, f"sessions/{SESSION_ID}/{tail}")
+    assert exc.value.status_code == 400
+    assert exc.value.detail == "invalid path"
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        f"sessions/{OTHER_SESSION_ID}/manifest.json",
+        f"sessions/{SESSION_ID}",
+        f"other/{SESSION_ID}/manifest.json",
+    ],
+)
+def test_rejects_paths_outside_session(path):
+    with pytest.raises(HTTPException) as exc:
+        assert_session_path(SESSION_ID, path)
+    assert exc.value.status_code == 400
+    assert exc.value.detail == "path must be inside session prefix"